@@ -0,0 +1,202 @@
+"""Anotação e re-codificação das imagens do checklist.
+
+Funções puras (só Pillow/simplejpeg): rodam tanto no pool de threads quanto nos processos do
+CPU_POOL=process, que importam apenas este módulo — sem cliente GCS, sessão HTTP ou caches.
+"""
+import io
+import struct
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageDraw
+import simplejpeg
+import orjson
+
+
+class ImageSettings(NamedTuple):
+    """Parâmetros do processamento de imagem, derivados da configuração do gerador."""
+    # Resolução alvo (px) das imagens no PDF
+    target_px: Tuple[int, int]
+    # Abaixo deste tamanho (ou desta largura em px) o JPEG já é leve o bastante: embute sem re-codificar
+    reencode_threshold_bytes: int
+    reencode_max_passthrough_width: int
+    # Foto anotada é evidência: q=25 borra os traços coloridos das marcações, então usa q>=60
+    annotated_jpeg_quality: int
+
+
+COLOR_MAP: Dict[str, Tuple[int, int, int]] = {
+    'red': (255, 0, 0),
+    'green': (0, 200, 0),
+    'blue': (0, 0, 255),
+    'yellow': (255, 200, 0),
+    'orange': (255, 140, 0),
+    'purple': (160, 32, 240),
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+}
+
+# Buffers reaproveitados por thread no re-encode (evita um BytesIO novo por imagem)
+_tls = threading.local()
+
+
+def color_tuple(color: str) -> Tuple[int, int, int]:
+    return COLOR_MAP.get((color or '').strip().lower(), (255, 0, 0))
+
+
+def normalize_annotations(annotations: List[Dict]) -> List[Tuple[str, float, float, float, float, Tuple[int, int, int]]]:
+    """Converte as anotações em (tipo, x, y, w, h, cor), já com 'coordinates' em JSON parseado."""
+    normalized = []
+    for ann in annotations or []:
+        try:
+            ann_type = (ann.get('annotationType') or ann.get('type') or 'box').strip().lower()
+            coords_raw = ann.get('coordinates')
+            coords = {}
+            if isinstance(coords_raw, dict):
+                coords = coords_raw
+            elif isinstance(coords_raw, str):
+                coords = orjson.loads(coords_raw)
+            normalized.append((
+                ann_type,
+                float(coords.get('x', 0)),
+                float(coords.get('y', 0)),
+                float(coords.get('w', 0)),
+                float(coords.get('h', 0)),
+                color_tuple(ann.get('color') or 'red'),
+            ))
+        except Exception as e:
+            print(f"Alerta: falha ao desenhar anotação: {str(e)}")
+    return normalized
+
+
+def apply_annotations(image_data: bytes, annotations: List[Dict], settings: ImageSettings) -> Optional[bytes]:
+    """Desenha as anotações e já devolve o JPEG final (redimensionado) num único decode."""
+    shapes = normalize_annotations(annotations)
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            # Reduz antes de desenhar: o traço fica visível no tamanho final e o buffer é pequeno.
+            # Tamanho original lido antes do draft, que já decodifica JPEG em escala reduzida
+            orig_w, orig_h = img.size
+            img.draft('RGB', settings.target_px)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail(settings.target_px, Image.Resampling.BILINEAR)
+            sx = img.width / orig_w
+            sy = img.height / orig_h
+            draw = ImageDraw.Draw(img)
+            width = 3
+            for ann_type, x, y, w, h, color in shapes:
+                try:
+                    x, y, w, h = x * sx, y * sy, w * sx, h * sy
+                    if ann_type in ('box', 'rectangle', 'rect'):
+                        draw.rectangle([(x, y), (x + w, y + h)], outline=color, width=width)
+                    elif ann_type in ('circle', 'ellipse'):
+                        draw.ellipse([(x, y), (x + w, y + h)], outline=color, width=width)
+                    elif ann_type in ('point', 'dot'):
+                        r = max(3.0, min(8.0, w or 5.0))
+                        draw.ellipse([(x - r, y - r), (x + r, y + r)], fill=color, outline=color, width=1)
+                    else:
+                        draw.rectangle([(x, y), (x + w, y + h)], outline=color, width=width)
+                except Exception as e:
+                    print(f"Alerta: falha ao desenhar anotação: {str(e)}")
+            out = io.BytesIO()
+            # Sem optimize: a segunda passada de Huffman quase dobra o encode para ganhar 2-4%
+            img.save(out, format='JPEG', quality=settings.annotated_jpeg_quality,
+                     optimize=False, progressive=False, subsampling=2)
+            return out.getvalue()
+    except Exception as e:
+        print(f"Alerta: não foi possível aplicar anotações, usando imagem original: {str(e)}")
+        return None
+
+
+def prepare_image(settings: ImageSettings, img_obj: Dict, data: Optional[bytes]) -> Optional[Tuple[bytes, str]]:
+    """Aplica anotações e re-codifica; retorna (bytes finais, legenda) ou None se a imagem for ignorada."""
+    if not data:
+        return None
+    annotations = img_obj.get('annotations') or []
+    rec = apply_annotations(data, annotations, settings) if annotations else None
+    if rec is None:
+        rec = quick_reencode_jpg(data, settings)
+    if rec is None:
+        try:
+            Image.open(io.BytesIO(data)).close()
+            final_bytes = data
+        except Exception:
+            print("Alerta: bytes de imagem inválidos após fallback; imagem será ignorada")
+            return None
+    else:
+        final_bytes = rec
+
+    descriptions: List[str] = []
+    for ann in annotations:
+        desc = (ann.get('description') or '').strip()
+        if desc:
+            descriptions.append(f"- {desc}")
+    return final_bytes, "\n".join(descriptions)
+
+
+def jpeg_info(data: bytes) -> Optional[Tuple[int, int, int, int, int]]:
+    """Lê (largura, altura, componentes, bits, marcador SOF) de um JPEG sem decodificá-lo."""
+    i = 2
+    n = len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker == 0xDA:
+            return None
+        seg_len = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if i + 10 > n:
+                return None
+            precision, height, width, components = struct.unpack('>BHHB', data[i + 4:i + 10])
+            return (width, height, components, precision, marker)
+        i += 2 + seg_len
+    return None
+
+
+def quick_reencode_jpg(image_data: bytes, settings: ImageSettings, quality: int = 25) -> Optional[bytes]:
+    # JPEG já pequeno (em bytes ou em largura): re-codificar só gastaria CPU
+    if image_data[:3] == b'\xff\xd8\xff':
+        if len(image_data) <= settings.reencode_threshold_bytes:
+            return image_data
+        info = jpeg_info(image_data)
+        if info and info[0] <= settings.reencode_max_passthrough_width:
+            return image_data
+    target_w, target_h = settings.target_px
+    # Caminho rápido: libjpeg-turbo (SIMD) via simplejpeg, sem construir objeto Pillow.
+    # min_width/min_height reduzem no domínio DCT (1/2, 1/4, 1/8) durante o decode.
+    # Sem optimize (segunda passada de Huffman), que dobra o custo do encode.
+    try:
+        arr = simplejpeg.decode_jpeg(
+            image_data, colorspace='RGB', fastdct=True, min_width=target_w, min_height=target_h
+        )
+        # 4:2:0 como no fallback Pillow e no caminho anotado (o default do simplejpeg é 4:4:4)
+        return simplejpeg.encode_jpeg(
+            arr, quality=quality, colorspace='RGB', colorsubsampling='420', fastdct=True
+        )
+    except Exception:
+        pass
+    # Fallback Pillow: entradas não-JPEG (PNG, WEBP...) ou JPEGs exóticos (CMYK etc.)
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            # draft: para JPEG, o libjpeg já decodifica em escala reduzida (no-op nos demais formatos)
+            img.draft('RGB', (target_w, target_h))
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((target_w, target_h), Image.Resampling.BILINEAR)
+            output_buffer = getattr(_tls, 'out', None)
+            if output_buffer is None:
+                output_buffer = _tls.out = io.BytesIO()
+            output_buffer.seek(0)
+            output_buffer.truncate()
+            img.save(output_buffer, format='JPEG', quality=quality)
+            return output_buffer.getvalue()
+    except Exception as e:
+        print(f"Alerta: Falha ao re-codificar imagem. Ignorada. Erro: {str(e)}")
+        return None
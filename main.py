@@ -1,25 +1,144 @@
 import os
 import io
+import math
+import tempfile
+import threading
+import hashlib
+from functools import partial, lru_cache
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, NamedTuple, Optional, List, Tuple
 
 from google.cloud import storage
-from PIL import Image, ImageDraw
+from google.api_core.exceptions import NotFound, NotModified
+import orjson
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
-from concurrent.futures import ThreadPoolExecutor
+from fpdf.image_parsing import get_img_info
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
 import traceback
 from flask import Request, Response
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse, unquote
 
+import image_processing
+
+
+# Pool de processos do trabalho de Pillow (CPU_POOL=process): um só por processo, criado no 1º uso.
+# 'spawn': este processo já tem threads de rede, e um fork poderia herdar um lock (stdout, urllib3) preso.
+# Os workers só executam image_processing.prepare_image, então importam só Pillow/simplejpeg
+_image_process_pool: Optional[ProcessPoolExecutor] = None
+_image_process_pool_lock = threading.Lock()
+
+
+def _get_image_process_pool(workers: int) -> ProcessPoolExecutor:
+    global _image_process_pool
+    with _image_process_pool_lock:
+        if _image_process_pool is None:
+            _image_process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        return _image_process_pool
+
+
+def _discard_image_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Descarta um pool quebrado (worker morto, ex.: OOM); a próxima chamada cria outro."""
+    global _image_process_pool
+    with _image_process_pool_lock:
+        if _image_process_pool is pool:
+            _image_process_pool = None
+    pool.shutdown(wait=False)
+
+
+# Helpers puros com cache: as mesmas datas e prefixos de URL se repetem entre itens e requisições
+@lru_cache(maxsize=4096)
+def _format_date_impl(s: str) -> str:
+    if not s or s.lower() in ('n/a', 'na', 'none', 'null', '-'):
+        return 'N/A'
+    for fmt in (
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%d %H:%M:%S.%f',
+        '%Y-%m-%dT%H:%M:%S',
+        '%Y-%m-%dT%H:%M:%S.%fZ',
+    ):
+        try:
+            return datetime.strptime(s, fmt).strftime('%d-%m-%Y %H:%M:%S')
+        except Exception:
+            continue
+    return s
+
+
+@lru_cache(maxsize=4096)
+def _parse_gcs_url_impl(url: str) -> Optional[Tuple[str, str]]:
+    try:
+        parsed = urlparse(url)
+        host = parsed.netloc
+        path = parsed.path
+        # gs://bucket/obj
+        if parsed.scheme == 'gs':
+            parts = path.lstrip('/').split('/', 1)
+            if len(parts) != 2:
+                return None
+            return (parsed.netloc, unquote(parts[1]))
+        # https://storage.googleapis.com/bucket/obj
+        if host == 'storage.googleapis.com' or host == 'storage.cloud.google.com':
+            parts = path.lstrip('/').split('/', 1)
+            if len(parts) != 2:
+                return None
+            bucket = parts[0]
+            object_path = parts[1]
+            return (bucket, unquote(object_path))
+        # https://bucket.storage.googleapis.com/obj (virtual hosted style)
+        if host.endswith('.storage.googleapis.com'):
+            bucket = host.split('.storage.googleapis.com')[0]
+            object_path = path.lstrip('/')
+            if not object_path:
+                return None
+            return (bucket, unquote(object_path))
+        return None
+    except Exception:
+        return None
+
+
+def _env_workers(name: str, default: int) -> int:
+    """Nº de workers vindo do ambiente: valor inválido usa o default; nunca menos que 1."""
+    try:
+        value = int(os.getenv(name, str(default)))
+    except ValueError:
+        print(f"Alerta: {name} inválido; usando {default}")
+        value = default
+    return max(1, value)
+
+
+class _PreparedItem(NamedTuple):
+    """Campos de um item do checklist, lidos do payload uma única vez."""
+    conforme: Optional[int]
+    status_text: str
+    problema: str
+    rotulo: str
+    imagens: List[Dict]
+    tags: List
+
 
 class PgrChecklistPDFGenerator:
     def __init__(self):
         # Carrega variáveis do .env quando executado localmente
         load_dotenv()
+        # Pools separados: I/O de rede (GCS/HTTP) e CPU (anotação/re-encode), para um download lento
+        # não ocupar um worker de CPU livre. O default do executor (cpu_count + 4) é baixo para I/O.
+        self.net_workers = _env_workers('NET_WORKERS', 16)
+        self.cpu_workers = _env_workers('CPU_WORKERS', max(2, os.cpu_count() or 2))
+        # 'process' tira a anotação/re-encode do GIL (ganho com vários vCPUs); com 1 vCPU, threads bastam
+        self.cpu_pool_kind = os.getenv('CPU_POOL', 'thread').strip().lower()
+
         self.gcs_client = storage.Client()
+        # Downloads GCS em paralelo: pool HTTP do cliente dimensionado para não faltar conexão aos workers
+        self.gcs_client._http.mount(
+            'https://', HTTPAdapter(pool_connections=self.net_workers, pool_maxsize=self.net_workers)
+        )
         self.bucket_name = os.getenv('GCS_BUCKET', 'docs-superapp')
         self.bucket = self.gcs_client.bucket(self.bucket_name)
 
@@ -30,6 +149,24 @@ class PgrChecklistPDFGenerator:
         self.allowed_image_hosts = set(
             h.strip() for h in os.getenv('ALLOWED_IMAGE_HOSTS', 'storage.googleapis.com,storage.cloud.google.com').split(',') if h.strip()
         )
+        # Subdomínios permitidos, para um único endswith(tupla) por URL
+        self._allowed_image_suffixes = tuple('.' + h for h in self.allowed_image_hosts)
+        # Sessão HTTP compartilhada: conexões keep-alive reaproveitadas entre os downloads paralelos
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False
+            ),
+        ))
+        # Cache LRU em memória (instâncias quentes) dos downloads: chave -> (etag, last_modified, bytes).
+        # Revalidado a cada uso com If-None-Match/If-Modified-Since: um 304 dispensa o corpo.
+        # Opcional (default 0): guarda bytes brutos (até MAX_IMAGE_BYTES cada) na memória da instância
+        self.image_cache_max_bytes = int(os.getenv('IMAGE_CACHE_BYTES', '0'))
+        self._image_cache: OrderedDict = OrderedDict()
+        self._image_cache_bytes = 0
+        self._image_cache_lock = threading.Lock()
         # Controle de preferência: usar SDK do GCS ao encontrar URLs do storage
         self.use_gcs_for_storage_urls = os.getenv('USE_GCS_FOR_STORAGE_URLS', 'true').strip().lower() in ('1', 'true', 'yes')
 
@@ -38,82 +175,61 @@ class PgrChecklistPDFGenerator:
         self.img_height = 35
         self.img_margin = 5
         self.line_height = 6
+        # Resolução alvo (px) das imagens no PDF, a 150dpi sobre o tamanho em mm
+        self.img_dpi = 150
+        self.img_target_px = (
+            math.ceil(self.img_width * self.img_dpi / 25.4),
+            math.ceil(self.img_height * self.img_dpi / 25.4),
+        )
 
-    def _color_tuple(self, color: str) -> Tuple[int, int, int]:
-        m = (color or '').strip().lower()
-        mapping = {
-            'red': (255, 0, 0),
-            'green': (0, 200, 0),
-            'blue': (0, 0, 255),
-            'yellow': (255, 200, 0),
-            'orange': (255, 140, 0),
-            'purple': (160, 32, 240),
-            'white': (255, 255, 255),
-            'black': (0, 0, 0),
-        }
-        return mapping.get(m, (255, 0, 0))
-
-    def _apply_annotations(self, image_data: bytes, annotations: List[Dict]) -> bytes:
-        """Aplica retângulos/pontos/círculos na imagem conforme 'annotations'."""
-        try:
-            with Image.open(io.BytesIO(image_data)) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                draw = ImageDraw.Draw(img)
-                for ann in annotations or []:
-                    try:
-                        ann_type = (ann.get('annotationType') or ann.get('type') or 'box').strip().lower()
-                        coords_raw = ann.get('coordinates')
-                        color = self._color_tuple(ann.get('color') or 'red')
-                        width = 3
-                        coords = {}
-                        if isinstance(coords_raw, dict):
-                            coords = coords_raw
-                        elif isinstance(coords_raw, str):
-                            import json
-                            coords = json.loads(coords_raw)
-                        x = float(coords.get('x', 0))
-                        y = float(coords.get('y', 0))
-                        w = float(coords.get('w', 0))
-                        h = float(coords.get('h', 0))
-
-                        if ann_type in ('box', 'rectangle', 'rect'):
-                            draw.rectangle([(x, y), (x + w, y + h)], outline=color, width=width)
-                        elif ann_type in ('circle', 'ellipse'):
-                            draw.ellipse([(x, y), (x + w, y + h)], outline=color, width=width)
-                        elif ann_type in ('point', 'dot'):
-                            r = max(3.0, min(8.0, w or 5.0))
-                            draw.ellipse([(x - r, y - r), (x + r, y + r)], fill=color, outline=color, width=1)
-                        else:
-                            draw.rectangle([(x, y), (x + w, y + h)], outline=color, width=width)
-                    except Exception as e:
-                        print(f"Alerta: falha ao desenhar anotação: {str(e)}")
-                out = io.BytesIO()
-                img.save(out, format='JPEG', quality=85, optimize=True)
-                return out.getvalue()
-        except Exception as e:
-            print(f"Alerta: não foi possível aplicar anotações: {str(e)}")
-            return image_data
+        # Abaixo deste tamanho (ou desta largura em px) o JPEG já é leve o bastante: embute sem re-codificar
+        self.reencode_threshold_bytes = int(os.getenv('REENCODE_THRESHOLD_BYTES', '40960'))  # 40KB
+        self.reencode_max_passthrough_width = self.img_target_px[0]
+        # Foto anotada é evidência: q=25 borra os traços coloridos das marcações, então usa q>=60
+        self.annotated_jpeg_quality = 60
+        # Tudo o que o processamento de imagem precisa, num objeto leve (vai aos processos do CPU_POOL)
+        self.image_settings = image_processing.ImageSettings(
+            target_px=self.img_target_px,
+            reencode_threshold_bytes=self.reencode_threshold_bytes,
+            reencode_max_passthrough_width=self.reencode_max_passthrough_width,
+            annotated_jpeg_quality=self.annotated_jpeg_quality,
+        )
+
+    # Valores de 'situation' reconhecidos (minúsculos, sem espaços); o resto conta como não conforme
+    _CONFORME_MAP: Dict[str, int] = {
+        'ok': 1, 'conforme': 1, 'aprovado': 1, 'positivo': 1, '1': 1, 'true': 1,
+        'nok': 0, 'naoconforme': 0, 'reprovado': 0, 'negativo': 0, '0': 0, 'false': 0,
+    }
+
+    def _to_conforme(self, v) -> int:
+        if v is True:
+            return 1
+        if v is False or v is None:
+            return 0
+        if isinstance(v, int):
+            return 1 if v else 0
+        return self._CONFORME_MAP.get(str(v).strip().lower().replace(' ', ''), 0)
 
     def _fetch_single_image_bytes(self, img_obj: Dict) -> Optional[bytes]:
         """Obtém os bytes de uma imagem considerando img_path, URLs GCS ou HTTP."""
         try:
             p = img_obj.get('img_path')
             u = img_obj.get('img_url') or img_obj.get('url')
+            # Sem exists(): o 404 do próprio download indica ausência (uma ida ao GCS em vez de duas)
             if p:
-                blob = self.bucket.blob(p)
-                if blob.exists():
-                    return blob.download_as_bytes()
-                print(f"Alerta: Imagem não encontrada no GCS (bucket padrão): {p}")
+                try:
+                    return self._blob_bytes(self.bucket.blob(p))
+                except NotFound:
+                    print(f"Alerta: Imagem não encontrada no GCS (bucket padrão): {p}")
             if u:
                 gcs_info = self._parse_gcs_url(u)
                 if gcs_info:
                     bucket_name, object_path = gcs_info
                     bkt = self.gcs_client.bucket(bucket_name)
-                    blob = bkt.blob(object_path)
-                    if blob.exists():
-                        return blob.download_as_bytes()
-                    print(f"Alerta: Imagem GCS não encontrada: gs://{bucket_name}/{object_path}")
+                    try:
+                        return self._blob_bytes(bkt.blob(object_path))
+                    except NotFound:
+                        print(f"Alerta: Imagem GCS não encontrada: gs://{bucket_name}/{object_path}")
                 else:
                     return self._download_single_url(u)
             return None
@@ -121,199 +237,280 @@ class PgrChecklistPDFGenerator:
             print(f"Erro ao obter imagem: {str(e)}")
             return None
 
-    def quick_reencode_jpg(self, image_data: bytes, quality: int = 25) -> Optional[bytes]:
-        try:
-            with Image.open(io.BytesIO(image_data)) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                output_buffer = io.BytesIO()
-                img.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-                return output_buffer.getvalue()
-        except Exception as e:
-            print(f"Alerta: Falha ao re-codificar imagem. Ignorada. Erro: {str(e)}")
-            return None
+    def _fetch_and_prepare_images(self, img_objs: List[Dict]) -> List[Optional[Tuple[bytes, str]]]:
+        """Baixa e processa todas as imagens, na mesma ordem de img_objs.
 
-    def download_images_batch(self, image_paths: List[str]) -> List[Optional[bytes]]:
-        try:
-            batch_size = 100
-            results = [None] * len(image_paths)
-
-            for chunk_start in range(0, len(image_paths), batch_size):
-                chunk_paths = image_paths[chunk_start:chunk_start + batch_size]
-                batch = self.gcs_client.batch()
-                blobs = [self.bucket.blob(path) for path in chunk_paths]
-                with batch:
-                    for i, blob in enumerate(blobs):
-                        global_idx = chunk_start + i
-                        if blob.exists():
-                            try:
-                                results[global_idx] = blob.download_as_bytes()
-                            except Exception as e:
-                                print(f"Alerta: Erro ao baixar {blob.name}: {str(e)}")
-                                results[global_idx] = None
-                        else:
-                            print(f"Alerta: Imagem não encontrada no GCS: {blob.name}")
-                            results[global_idx] = None
+        Cada download roda no pool de rede; assim que termina, a anotação/re-encode da imagem vai
+        para o pool de CPU. Espera de rede e trabalho de Pillow se sobrepõem entre imagens e itens.
+        """
+        results: List[Optional[Tuple[bytes, str]]] = [None] * len(img_objs)
+        if not img_objs:
             return results
-        except Exception as e:
-            print(f"Erro ao baixar imagens em lote: {str(e)}")
-            return [None] * len(image_paths)
+        # Mesma imagem (origem + anotações) em vários itens: baixa e processa uma vez só
+        unique: Dict[Tuple, int] = {}
+        copies: List[List[int]] = []
+        for k, img in enumerate(img_objs):
+            dedup_key = self._image_dedup_key(img, k)
+            if dedup_key in unique:
+                copies[unique[dedup_key]].append(k)
+            else:
+                unique[dedup_key] = len(copies)
+                copies.append([k])
+        process_pool = None
+        if self.cpu_pool_kind == 'process':
+            process_pool = _get_image_process_pool(self.cpu_workers)
+        with ThreadPoolExecutor(max_workers=min(self.net_workers, len(copies))) as net_pool, \
+                ThreadPoolExecutor(max_workers=self.cpu_workers) as thread_pool:
+            fetches = {
+                net_pool.submit(self._fetch_single_image_bytes, img_objs[ks[0]]): ks for ks in copies
+            }
+            # future -> (índices, bytes brutos): no modo processo o bruto fica até o resultado,
+            # para refazer em thread se o pool quebrar; em thread, só até o processamento
+            preps: Dict = {}
+            for future in as_completed(fetches):
+                # pop: o download bruto (até MAX_IMAGE_BYTES) não fica preso ao dict de downloads; é o
+                # único ponto que reduz o pico. Os bytes finais ficam em pdf.images até o output()
+                ks = fetches.pop(future)
+                data = future.result()
+                if process_pool is not None:
+                    try:
+                        preps[process_pool.submit(image_processing.prepare_image, self.image_settings, img_objs[ks[0]], data)] = (ks, data)
+                        continue
+                    except BrokenProcessPool:
+                        print("Alerta: pool de processos de imagem quebrado; seguindo em threads")
+                        _discard_image_process_pool(process_pool)
+                        process_pool = None
+                preps[thread_pool.submit(image_processing.prepare_image, self.image_settings, img_objs[ks[0]], data)] = (ks, None)
+            # as_completed: uma imagem lenta no CPU não segura a gravação das que já terminaram
+            retries: Dict = {}
+            for future in as_completed(preps):
+                ks, data = preps.pop(future)
+                try:
+                    prepared = future.result()
+                except BrokenProcessPool:
+                    # Worker morto (ex.: OOM numa foto grande): refaz no pool de threads
+                    if process_pool is not None:
+                        print("Alerta: pool de processos de imagem quebrado; seguindo em threads")
+                        _discard_image_process_pool(process_pool)
+                        process_pool = None
+                    retries[thread_pool.submit(image_processing.prepare_image, self.image_settings, img_objs[ks[0]], data)] = ks
+                    continue
+                for k in ks:
+                    results[k] = prepared
+            for future in as_completed(retries):
+                prepared = future.result()
+                for k in retries[future]:
+                    results[k] = prepared
+        return results
 
-    def _parse_gcs_url(self, url: str) -> Optional[Tuple[str, str]]:
+    def _image_dedup_key(self, img_obj: Dict, index: int) -> Tuple:
+        """Chave de deduplicação: origem (img_path/URL) + anotações; entradas fora do padrão não são agrupadas."""
         try:
-            if not self.use_gcs_for_storage_urls:
-                return None
-            parsed = urlparse(url)
-            host = parsed.netloc
-            path = parsed.path
-            # gs://bucket/obj
-            if parsed.scheme == 'gs':
-                parts = path.lstrip('/').split('/', 1)
-                if len(parts) != 2:
-                    return None
-                return (parsed.netloc, unquote(parts[1]))
-            # https://storage.googleapis.com/bucket/obj
-            if host == 'storage.googleapis.com' or host == 'storage.cloud.google.com':
-                parts = path.lstrip('/').split('/', 1)
-                if len(parts) != 2:
-                    return None
-                bucket = parts[0]
-                object_path = parts[1]
-                return (bucket, unquote(object_path))
-            # https://bucket.storage.googleapis.com/obj (virtual hosted style)
-            if host.endswith('.storage.googleapis.com'):
-                bucket = host.split('.storage.googleapis.com')[0]
-                object_path = path.lstrip('/')
-                if not object_path:
-                    return None
-                return (bucket, unquote(object_path))
-            return None
+            return (
+                img_obj.get('img_path'),
+                img_obj.get('img_url') or img_obj.get('url'),
+                orjson.dumps(img_obj.get('annotations') or [], option=orjson.OPT_SORT_KEYS),
+            )
         except Exception:
+            return ('__index__', index)
+
+    def quick_reencode_jpg(self, image_data: bytes, quality: int = 25) -> Optional[bytes]:
+        return image_processing.quick_reencode_jpg(image_data, self.image_settings, quality)
+
+    def _cache_get(self, key: str) -> Optional[Tuple[Optional[str], Optional[str], bytes]]:
+        if self.image_cache_max_bytes <= 0:
             return None
+        with self._image_cache_lock:
+            entry = self._image_cache.get(key)
+            if entry is not None:
+                self._image_cache.move_to_end(key)
+            return entry
+
+    def _cache_put(self, key: str, etag: Optional[str], last_modified: Optional[str], data: bytes) -> None:
+        # Sem validador não há como revalidar; objetos maiores que o orçamento inteiro não entram
+        if not (etag or last_modified) or len(data) > self.image_cache_max_bytes:
+            return
+        with self._image_cache_lock:
+            old = self._image_cache.pop(key, None)
+            if old is not None:
+                self._image_cache_bytes -= len(old[2])
+            self._image_cache[key] = (etag, last_modified, data)
+            self._image_cache_bytes += len(data)
+            while self._image_cache_bytes > self.image_cache_max_bytes:
+                _, (_, _, evicted) = self._image_cache.popitem(last=False)
+                self._image_cache_bytes -= len(evicted)
+
+    def _blob_bytes(self, blob) -> bytes:
+        """download_as_bytes() condicional: com cópia em cache, só traz o corpo se o ETag mudou."""
+        key = f"gs://{blob.bucket.name}/{blob.name}"
+        cached = self._cache_get(key)
+        if cached is None:
+            data = blob.download_as_bytes()
+        else:
+            try:
+                data = blob.download_as_bytes(if_etag_not_match=cached[0])
+            except NotModified:
+                return cached[2]
+        self._cache_put(key, blob.etag, None, data)
+        return data
 
-    def download_gcs_targets_batch(self, targets: List[Tuple[str, str]]) -> List[Optional[bytes]]:
-        """Baixa objetos GCS especificando (bucket, object_path) por item."""
-        try:
-            results: List[Optional[bytes]] = [None] * len(targets)
-            if not targets:
-                return results
-            # Agrupar por bucket para minimizar overhead
-            by_bucket: Dict[str, List[Tuple[int, str]]] = {}
-            for idx, (bucket_name, object_path) in enumerate(targets):
-                by_bucket.setdefault(bucket_name, []).append((idx, object_path))
-
-            for bucket_name, items in by_bucket.items():
-                bucket = self.gcs_client.bucket(bucket_name)
-                for idx, object_path in items:
-                    blob = bucket.blob(object_path)
-                    try:
-                        if blob.exists():
-                            results[idx] = blob.download_as_bytes()
-                        else:
-                            print(f"Alerta: Imagem não encontrada no GCS: gs://{bucket_name}/{object_path}")
-                            results[idx] = None
-                    except Exception as e:
-                        print(f"Alerta: Erro ao baixar gs://{bucket_name}/{object_path}: {str(e)}")
-                        results[idx] = None
-            return results
-        except Exception as e:
-            print(f"Erro ao baixar imagens GCS (bucket,obj) em lote: {str(e)}")
-            return [None] * len(targets)
+    def _parse_gcs_url(self, url: str) -> Optional[Tuple[str, str]]:
+        if not self.use_gcs_for_storage_urls or not isinstance(url, str):
+            return None
+        return _parse_gcs_url_impl(url)
+
+    def _looks_like_image(self, data: bytes) -> bool:
+        """Checagem barata por magic bytes: JPEG, PNG, GIF ou WEBP."""
+        return (
+            data[:3] == b'\xff\xd8\xff'
+            or data[:8] == b'\x89PNG\r\n\x1a\n'
+            or data[:4] == b'GIF8'
+            or (data[:4] == b'RIFF' and data[8:12] == b'WEBP')
+        )
 
     def _download_single_url(self, url: str) -> Optional[bytes]:
         try:
             parsed = urlparse(url)
-            if parsed.hostname and not any(
-                parsed.hostname == h or parsed.hostname.endswith('.' + h) for h in self.allowed_image_hosts
+            if parsed.hostname and not (
+                parsed.hostname in self.allowed_image_hosts or parsed.hostname.endswith(self._allowed_image_suffixes)
             ):
                 print(f"Host não permitido para download: {parsed.hostname}")
                 return None
-            with requests.get(url, stream=True, timeout=20) as r:
+            # URL com query (ex.: assinada, X-Goog-Signature única) nunca se repete: não entra no cache
+            cacheable = not parsed.query
+            cached = self._cache_get(url) if cacheable else None
+            headers = {}
+            if cached:
+                etag, last_modified, _ = cached
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+            with self.http.get(url, stream=True, timeout=20, headers=headers) as r:
+                if r.status_code == 304 and cached:
+                    return cached[2]
                 r.raise_for_status()
-                total = 0
-                buf = io.BytesIO()
-                for chunk in r.iter_content(chunk_size=8192):
-                    if not chunk:
-                        continue
-                    total += len(chunk)
-                    if total > self.max_image_bytes:
+                content_length = r.headers.get('Content-Length', '')
+                if content_length.isdigit() and not r.headers.get('Content-Encoding'):
+                    size = int(content_length)
+                    if size > self.max_image_bytes:
                         print("Imagem excede tamanho máximo permitido")
                         return None
-                    buf.write(chunk)
-                data = buf.getvalue()
-                # Valida abrindo com Pillow (alguns servidores retornam application/octet-stream)
-                try:
-                    with Image.open(io.BytesIO(data)) as _:
-                        pass
-                except Exception as e:
-                    print(f"Download não parece ser imagem válida: {str(e)}")
+                    # Tamanho conhecido (sem compressão de transporte): lê do socket direto num buffer
+                    # pré-alocado, sem a lista de chunks + join que o r.content monta
+                    buf = bytearray(size)
+                    view = memoryview(buf)
+                    offset = 0
+                    while offset < size:
+                        n = r.raw.readinto(view[offset:])
+                        if not n:
+                            break
+                        offset += n
+                    view.release()
+                    if offset < size:
+                        print(f"Download incompleto: {offset} de {size} bytes")
+                        return None
+                    data = bytes(buf)
+                    del buf
+                else:
+                    buf = bytearray()
+                    for chunk in r.iter_content(chunk_size=65536):
+                        buf.extend(chunk)
+                        if len(buf) > self.max_image_bytes:
+                            print("Imagem excede tamanho máximo permitido")
+                            return None
+                    data = bytes(buf)
+                # Valida pela assinatura (alguns servidores retornam application/octet-stream).
+                # Corrompidos caem depois: no decode do re-encode ou, para JPEG embutido sem
+                # re-codificar, na checagem de SOF/EOI de _pdf_image_name
+                if not self._looks_like_image(data):
+                    print("Download não parece ser imagem válida")
                     return None
+                if cacheable:
+                    self._cache_put(url, r.headers.get('ETag'), r.headers.get('Last-Modified'), data)
                 return data
         except Exception as e:
             print(f"Erro ao baixar URL {url}: {str(e)}")
             return None
 
-    def download_urls_batch(self, image_urls: List[str]) -> List[Optional[bytes]]:
-        results: List[Optional[bytes]] = [None] * len(image_urls)
-        if not image_urls:
-            return results
-        with ThreadPoolExecutor() as executor:
-            future_to_idx = {executor.submit(self._download_single_url, url): i for i, url in enumerate(image_urls)}
-            for future in future_to_idx:
-                idx = future_to_idx[future]
-                try:
-                    results[idx] = future.result()
-                except Exception as e:
-                    print(f"Erro no download paralelo de URL índice {idx}: {str(e)}")
-                    results[idx] = None
-        return results
-
-    def _get_text_line_count(self, pdf: FPDF, text: str, width: float) -> int:
+    def _pdf_image_name(self, pdf: FPDF, img_data: bytes) -> str:
+        """Registra a imagem em pdf.images uma vez por conteúdo e devolve o nome a passar para pdf.image().
+
+        A mesma foto repetida em vários itens vira uma única referência no PDF.
+        """
+        name = 'img-' + hashlib.blake2b(img_data, digest_size=16).hexdigest()
+        if name not in pdf.images:
+            jpeg = image_processing.jpeg_info(img_data) if img_data[:3] == b'\xff\xd8\xff' else None
+            if (
+                jpeg
+                and jpeg[2] in (1, 3)
+                and jpeg[3] == 8
+                and jpeg[4] in (0xC0, 0xC1, 0xC2)  # baseline/estendido/progressivo Huffman
+                and img_data.rstrip(b'\0')[-2:] == b'\xff\xd9'  # EOI: descarta JPEG truncado
+            ):
+                # JPEG pronto (cinza/RGB, 8 bits): os bytes entram direto como DCTDecode.
+                # O get_img_info do fpdf abriria com Pillow e re-codificaria o JPEG inteiro;
+                # ele fica para o resto (lossless, aritmético, truncado...), que o Pillow valida.
+                width, height, components, _, _ = jpeg
+                info = {
+                    'data': img_data,
+                    'w': width,
+                    'h': height,
+                    'cs': 'DeviceGray' if components == 1 else 'DeviceRGB',
+                    'bpc': 8,
+                    'f': 'DCTDecode',
+                    'trns': '',
+                }
+            else:
+                info = get_img_info(io.BytesIO(img_data), pdf.image_filter)
+            info['i'] = len(pdf.images) + 1
+            info['usages'] = 0  # pdf.image() contabiliza cada uso
+            pdf.images[name] = info
+        return name
+
+    def _string_width(self, pdf: FPDF, text: str, widths: Dict[Tuple[str, str, float, str], float]) -> float:
+        """Largura do texto na fonte atual, memoizada em widths (um dict por documento)."""
+        k = (pdf.font_family, pdf.font_style, pdf.font_size_pt, text)
+        w = widths.get(k)
+        if w is None:
+            w = pdf.get_string_width(text)
+            widths[k] = w
+        return w
+
+    def _get_text_line_count(self, pdf: FPDF, text: str, width: float,
+                             widths: Dict[Tuple[str, str, float, str], float]) -> int:
         if not text:
             return 1
-        lines = text.split('\n')
-        total_lines = 0
-        for line in lines:
-            if not line:
-                total_lines += 1
-                continue
-            words = line.split(' ')
-            current_line = ""
-            line_count_for_segment = 1
-            for word in words:
-                if pdf.get_string_width(word) > width:
-                    if current_line:
-                        line_count_for_segment += 1
-                    current_line = ""
-                    continue
-                test_line = current_line + " " + word if current_line else word
-                if pdf.get_string_width(test_line) <= width:
-                    current_line = test_line
+        # Quebra gulosa por palavra com larguras memoizadas; mesma margem interna do multi_cell
+        max_w = width - 2 * pdf.c_margin
+        space_w = self._string_width(pdf, ' ', widths)
+        total = 0
+        for paragraph in text.split('\n'):
+            lines = 1
+            cur_w = None
+            for word in paragraph.split(' '):
+                word_w = self._string_width(pdf, word, widths) if word else 0.0
+                if cur_w is None:
+                    cur_w = word_w
+                elif cur_w + space_w + word_w > max_w:
+                    lines += 1
+                    cur_w = word_w
                 else:
-                    line_count_for_segment += 1
-                    current_line = word
-            total_lines += line_count_for_segment
-        return total_lines
+                    cur_w += space_w + word_w
+                if cur_w > max_w:
+                    # Palavra maior que a linha: o multi_cell quebra no meio dela
+                    extra = int(cur_w // max_w)
+                    lines += extra
+                    cur_w -= extra * max_w
+            total += lines
+        return max(1, total)
 
     def _format_date(self, date_str: Optional[str]) -> str:
         if date_str is None:
             return 'N/A'
-        s = str(date_str).strip()
-        if not s or s.lower() in ('n/a', 'na', 'none', 'null', '-'):
-            return 'N/A'
-        for fmt in (
-            '%Y-%m-%d %H:%M:%S',
-            '%Y-%m-%d %H:%M:%S.%f',
-            '%Y-%m-%dT%H:%M:%S',
-            '%Y-%m-%dT%H:%M:%S.%fZ',
-        ):
-            try:
-                return datetime.strptime(s, fmt).strftime('%d-%m-%Y %H:%M:%S')
-            except Exception:
-                continue
-        return s
+        return _format_date_impl(str(date_str).strip())
 
-    def generate_pdf(self, request_data: Dict, key: str) -> bytes:
+    def _build_pdf(self, request_data: Dict, key: str) -> FPDF:
         try:
             original = request_data.get('original', {})
             if not isinstance(original, dict):
@@ -323,20 +520,10 @@ class PgrChecklistPDFGenerator:
             revisao = original.get('revisao', {})
 
             # Regras PGR: situation é string. Idealmente vem pré-mapeado no payload
-            # como conforme: 1/0. Se não, tentamos mapear:
-            def to_conforme(v):
-                if isinstance(v, int):
-                    return v
-                if isinstance(v, str):
-                    vs = v.strip().lower()
-                    return 1 if vs in ('ok', 'conforme', 'aprovado', 'positivo') else 0
-                if isinstance(v, bool):
-                    return 1 if v else 0
-                return 0
-
+            # como conforme: 1/0. Se não, tentamos mapear
             for it in items:
                 if 'conforme' not in it and 'situation' in it:
-                    it['conforme'] = to_conforme(it.get('situation'))
+                    it['conforme'] = self._to_conforme(it.get('situation'))
 
             ok_items = [item for item in items if item.get('conforme') == 1]
             nok_items = [item for item in items if item.get('conforme') == 0]
@@ -360,6 +547,9 @@ class PgrChecklistPDFGenerator:
             colaborador = (revisao.get('name') or 'N/A')
             validador = (revisao.get('validador') or 'N/A')
 
+            # Larguras de texto já medidas neste documento, por (fonte, estilo, tamanho, texto).
+            # Local à chamada: o gerador é compartilhado entre requisições concorrentes
+            widths: Dict[Tuple[str, str, float, str], float] = {}
             pdf = FPDF()
             pdf.set_title(f'Checklist PGR - {key}')
             pdf.set_margins(10, 10, 10)
@@ -426,216 +616,272 @@ class PgrChecklistPDFGenerator:
             pdf.cell(col_width, self.line_height, f"Fotos OK: {complemento_checklist['totalFotos']['ok']} / NOK: {complemento_checklist['totalFotos']['nok']}", border=1, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             pdf.ln(8)
 
-            with ThreadPoolExecutor() as executor:
-                for item in items:
-                    conforme = item.get('conforme')
-                    problema = (item.get('problema_identificado', '') or 'Nenhum').strip().replace("\n", " ")
-                    imagens = item.get('imagens', []) or []
-                    # 'budget' não é monetário; significa contorno/box do status — já será aplicado no badge
-
-                    rotulo = item.get('item') or item.get('label') or ''
-
-                    # Título do item
-                    item_title_line = f"Item: {rotulo}"
-                    problema_line = f"Problema(s): {problema}"
-
-                    available_width = pdf.w - pdf.l_margin - pdf.r_margin
-                    lines_item = self._get_text_line_count(pdf, item_title_line, available_width)
-                    lines_prob = self._get_text_line_count(pdf, problema_line, available_width)
-                    text_height = (lines_item + lines_prob + 1) * 5  # +1 para a linha do status/badges
-
-                    image_rows = (len(imagens) + 2) // 3
-                    images_height = image_rows * (self.img_height + self.img_margin)
-
-                    block_height = text_height + images_height + 15
-
-                    if pdf.get_y() + block_height > pdf.page_break_trigger:
-                        pdf.add_page()
-
-                    # Linha: Item
-                    pdf.multi_cell(w=0, h=5, txt=item_title_line, border=0, align='L')
+            # Pré-passo: campos de cada item lidos uma única vez, na ordem do checklist
+            prepared_items = [
+                _PreparedItem(
+                    conforme=item.get('conforme'),
+                    status_text='Conforme' if item.get('conforme') == 1 else 'Não Conforme',
+                    problema=(item.get('problema_identificado', '') or 'Nenhum').strip().replace("\n", " "),
+                    rotulo=item.get('item') or item.get('label') or '',
+                    imagens=item.get('imagens', []) or [],
+                    tags=item.get('tags') or [],
+                )
+                for item in items
+            ]
+
+            # Imagens de todos os itens buscadas e processadas juntas, antes do layout
+            flat_imgs: List[Dict] = []
+            item_ranges: List[Tuple[int, int]] = []
+            for prepared in prepared_items:
+                start = len(flat_imgs)
+                flat_imgs.extend(prepared.imagens)
+                item_ranges.append((start, len(flat_imgs)))
+
+            prepared_images = self._fetch_and_prepare_images(flat_imgs)
+
+            # Pré-passo de medidas, agrupado por fonte: o laço de escrita não mede mais nenhum texto
+            available_width = pdf.w - pdf.l_margin - pdf.r_margin
+            right_edge = pdf.w - pdf.r_margin
+            pad_x = 3
+            badge_h = 5
+            tag_pad = 2
+            # (linha do título, linha do problema, altura do texto) por item
+            item_texts: List[Tuple[str, str, float]] = []
+            for prepared in prepared_items:
+                item_title_line = f"Item: {prepared.rotulo}"
+                problema_line = f"Problema(s): {prepared.problema}"
+                lines_item = self._get_text_line_count(pdf, item_title_line, available_width, widths)
+                lines_prob = self._get_text_line_count(pdf, problema_line, available_width, widths)
+                # +1 para a linha do status/badges
+                item_texts.append((item_title_line, problema_line, (lines_item + lines_prob + 1) * 5))
+            # Linhas de cada legenda (a 10pt, como antes), para o laço não alternar fonte só para medir
+            caption_lines: List[int] = []
+            for prepared_image in prepared_images:
+                _, caption = prepared_image or (None, '')
+                caption = (caption or '').strip()
+                caption_lines.append(
+                    self._get_text_line_count(pdf, caption.replace('\r', ''), self.img_width, widths) if caption else 0
+                )
+            status_label_w = self._string_width(pdf, "Status: ", widths) + 1
+
+            pdf.set_font("helvetica", style="B", size=9)
+            badge_widths = {
+                status: self._string_width(pdf, status, widths) + 2 * pad_x
+                for status in set(prepared.status_text for prepared in prepared_items)
+            }
 
-                    # Linha: Status (badge discreta com contorno)
-                    pdf.set_x(pdf.l_margin)
-                    status_text = 'Conforme' if conforme == 1 else 'Não Conforme'
-                    if conforme == 1:
-                        stroke_rgb = (76, 175, 80)   # verde médio para contorno
-                        text_rgb = (46, 125, 50)     # verde escuro no texto
-                        bg_rgb = (245, 252, 246)     # leve fundo quase branco
-                    else:
-                        stroke_rgb = (229, 57, 53)   # vermelho médio para contorno
-                        text_rgb = (183, 28, 28)
-                        bg_rgb = (254, 246, 246)
+            # Tags já como (rótulo, largura) a 8pt
+            pdf.set_font("helvetica", size=8)
+            item_tags: List[List[Tuple[str, float]]] = []
+            for prepared in prepared_items:
+                labels: List[Tuple[str, float]] = []
+                if isinstance(prepared.tags, list):
+                    for t in prepared.tags:
+                        try:
+                            if isinstance(t, dict):
+                                k = (t.get('key') or '').strip()
+                                v = (t.get('value') or '').strip()
+                                label = (f"{k}: {v}" if k and v else (v or k))
+                            else:
+                                label = str(t).strip()
+                        except Exception:
+                            continue
+                        if label:
+                            labels.append((label, self._string_width(pdf, label, widths)))
+                item_tags.append(labels)
+            pdf.set_font("helvetica", size=10)
 
-                    pdf.set_text_color(0, 0, 0)
-                    pdf.set_font("helvetica", size=10)
-                    pdf.cell(pdf.get_string_width("Status: ") + 1, 5, "Status: ", border=0, align='L')
-
-                    pad_x = 3
-                    badge_h = 5
-                    badge_w = pdf.get_string_width(status_text) + 2 * pad_x
-                    x0 = pdf.get_x()
-                    y0 = pdf.get_y()
-                    # Leve fundo (opcional) e contorno
-                    try:
-                        pdf.set_fill_color(*bg_rgb)
-                        pdf.set_draw_color(*stroke_rgb)
-                        pdf.set_line_width(0.4)
-                        pdf.rounded_rect(x0, y0, badge_w, badge_h, 1.5, style='FD')
-                    except Exception:
-                        # Fallback: célula com borda
-                        pdf.set_draw_color(*stroke_rgb)
-                        pdf.set_line_width(0.4)
-                        pdf.rect(x0, y0, badge_w, badge_h)
-
-                    # Texto centralizado dentro do badge
-                    pdf.set_text_color(*text_rgb)
-                    pdf.set_font("helvetica", style="B", size=9)
-                    pdf.set_xy(x0, y0)
-                    pdf.cell(badge_w, badge_h, status_text, border=0, align='C', fill=False)
-
-                    # Tags do item como badges discretas cinza (ao lado do status), com quebra de linha automática
-                    tags = item.get('tags') or []
-                    if isinstance(tags, list) and tags:
-                        pdf.set_font("helvetica", size=8)
-                        pdf.set_text_color(80, 80, 80)
-                        pdf.set_draw_color(180, 180, 180)
-                        pdf.set_line_width(0.3)
-                        pdf.set_x(x0 + badge_w + 3)
-                        right_edge = pdf.w - pdf.r_margin
-                        for t in tags:
-                            try:
-                                label = ''
-                                if isinstance(t, dict):
-                                    k = (t.get('key') or '').strip()
-                                    v = (t.get('value') or '').strip()
-                                    label = (f"{k}: {v}" if k and v else (v or k))
-                                else:
-                                    label = str(t).strip()
-                                if not label:
-                                    continue
-                                tw = pdf.get_string_width(label)
-                                pad = 2
-                                bw = tw + pad * 2
+            # O fpdf emite RG/rg/w a cada set_draw_color/set_fill_color/set_line_width, mesmo sem
+            # mudança de valor: só repassa o que mudou desde a última chamada
+            pen: Dict[str, object] = {}
+
+            def set_pen(draw_rgb=None, fill_rgb=None, line_width=None):
+                if draw_rgb is not None and pen.get('draw') != draw_rgb:
+                    pdf.set_draw_color(*draw_rgb)
+                    pen['draw'] = draw_rgb
+                if fill_rgb is not None and pen.get('fill') != fill_rgb:
+                    pdf.set_fill_color(*fill_rgb)
+                    pen['fill'] = fill_rgb
+                if line_width is not None and pen.get('line_width') != line_width:
+                    pdf.set_line_width(line_width)
+                    pen['line_width'] = line_width
+
+            for item_idx, (conforme, status_text, problema, rotulo, imagens, tags) in enumerate(prepared_items):
+                # 'budget' não é monetário; significa contorno/box do status — já será aplicado no badge
+                item_title_line, problema_line, text_height = item_texts[item_idx]
+
+                image_rows = (len(imagens) + 2) // 3
+                images_height = image_rows * (self.img_height + self.img_margin)
+
+                block_height = text_height + images_height + 15
+
+                if pdf.get_y() + block_height > pdf.page_break_trigger:
+                    pdf.add_page()
+
+                # Linha: Item
+                pdf.multi_cell(w=0, h=5, txt=item_title_line, border=0, align='L')
+
+                # Linha: Status (badge discreta com contorno)
+                pdf.set_x(pdf.l_margin)
+                if conforme == 1:
+                    stroke_rgb = (76, 175, 80)   # verde médio para contorno
+                    text_rgb = (46, 125, 50)     # verde escuro no texto
+                    bg_rgb = (245, 252, 246)     # leve fundo quase branco
+                else:
+                    stroke_rgb = (229, 57, 53)   # vermelho médio para contorno
+                    text_rgb = (183, 28, 28)
+                    bg_rgb = (254, 246, 246)
+
+                pdf.set_text_color(0, 0, 0)
+                pdf.set_font("helvetica", size=10)
+                pdf.cell(status_label_w, 5, "Status: ", border=0, align='L')
+
+                badge_w = badge_widths[status_text]
+                x0 = pdf.get_x()
+                y0 = pdf.get_y()
+                # Leve fundo (opcional) e contorno
+                try:
+                    set_pen(draw_rgb=stroke_rgb, fill_rgb=bg_rgb, line_width=0.4)
+                    pdf.rounded_rect(x0, y0, badge_w, badge_h, 1.5, style='FD')
+                except Exception:
+                    # Fallback: célula com borda
+                    set_pen(draw_rgb=stroke_rgb, line_width=0.4)
+                    pdf.rect(x0, y0, badge_w, badge_h)
+
+                # Texto centralizado dentro do badge
+                pdf.set_text_color(*text_rgb)
+                pdf.set_font("helvetica", style="B", size=9)
+                pdf.set_xy(x0, y0)
+                pdf.cell(badge_w, badge_h, status_text, border=0, align='C', fill=False)
+
+                # Tags do item como badges discretas cinza (ao lado do status), com quebra de linha automática
+                if item_tags[item_idx]:
+                    pdf.set_font("helvetica", size=8)
+                    pdf.set_text_color(80, 80, 80)
+                    set_pen(draw_rgb=(180, 180, 180), line_width=0.3)
+                    pdf.set_x(x0 + badge_w + 3)
+                    for label, tw in item_tags[item_idx]:
+                        try:
+                            bw = tw + tag_pad * 2
+                            x = pdf.get_x()
+                            y = pdf.get_y()
+                            if x + bw > right_edge:
+                                pdf.ln(badge_h)
+                                pdf.set_x(pdf.l_margin)
                                 x = pdf.get_x()
                                 y = pdf.get_y()
-                                if x + bw > right_edge:
-                                    pdf.ln(badge_h)
-                                    pdf.set_x(pdf.l_margin)
-                                    x = pdf.get_x()
-                                    y = pdf.get_y()
-                                try:
-                                    pdf.rounded_rect(x, y, bw, badge_h, 1.2, style='D')
-                                except Exception:
-                                    pdf.rect(x, y, bw, badge_h)
-                                pdf.set_xy(x + pad, y)
-                                pdf.cell(tw, badge_h, label, border=0, align='L')
-                                pdf.set_x(x + bw + 2)
+                            try:
+                                pdf.rounded_rect(x, y, bw, badge_h, 1.2, style='D')
                             except Exception:
-                                continue
-
-                    # Quebra de linha após status/tags
-                    pdf.ln(badge_h)
+                                pdf.rect(x, y, bw, badge_h)
+                            pdf.set_xy(x + tag_pad, y)
+                            pdf.cell(tw, badge_h, label, border=0, align='L')
+                            pdf.set_x(x + bw + 2)
+                        except Exception:
+                            continue
+
+                # Quebra de linha após status/tags
+                pdf.ln(badge_h)
+
+                # Linha: Problema(s)
+                pdf.set_text_color(0, 0, 0)
+                pdf.set_font("helvetica", size=10)
+                pdf.multi_cell(w=0, h=5, txt=problema_line, border=0, align='L')
+
+                if imagens:
+                    pdf.ln(2)
+                    x_start = pdf.get_x()
+                    col_count = 0
+                    row_max_height = 0
+
+                    start, end = item_ranges[item_idx]
+                    processed_images_with_captions = [
+                        (prepared_images[k], caption_lines[k]) for k in range(start, end) if prepared_images[k]
+                    ]
+
+                    for (img_data, caption), lines in processed_images_with_captions:
+                        if not img_data:
+                            continue
+                        if col_count == 3:
+                            pdf.ln(row_max_height + self.img_margin if row_max_height else (self.img_height + self.img_margin))
+                            pdf.set_x(x_start)
+                            col_count = 0
+                            row_max_height = 0
+
+                        x = pdf.get_x()
+                        y = pdf.get_y()
+                        try:
+                            pdf.image(self._pdf_image_name(pdf, img_data), x=x, y=y, w=self.img_width, h=self.img_height)
+                        except Exception as e:
+                            print(f"Alerta: falha ao inserir imagem no PDF; ignorando. Erro: {str(e)}")
+                            continue
+
+                        used_height = self.img_height
+                        cap = (caption or '').strip()
+                        if cap:
+                            pdf.set_xy(x, y + self.img_height + 1)
+                            line_h = 4
+                            # 8pt fica ativo até o fim das imagens do item (set_font repetido é no-op)
+                            pdf.set_font("helvetica", size=8)
+                            pdf.multi_cell(self.img_width, line_h, cap, border=0)
+                            used_height += 1 + lines * line_h
+
+                        row_max_height = max(row_max_height, used_height)
+                        pdf.set_xy(x + self.img_width + self.img_margin, y)
+                        col_count += 1
 
-                    # Linha: Problema(s)
-                    pdf.set_text_color(0, 0, 0)
                     pdf.set_font("helvetica", size=10)
-                    pdf.multi_cell(w=0, h=5, txt=problema_line, border=0, align='L')
-
-                    if imagens:
-                        pdf.ln(2)
-                        x_start = pdf.get_x()
-                        col_count = 0
-                        row_max_height = 0
-
-                        processed_images_with_captions: List[Tuple[bytes, str]] = []
-                        for img in imagens:
-                            data = self._fetch_single_image_bytes(img)
-                            if not data:
-                                continue
-                            annotations = img.get('annotations') or []
-                            try:
-                                annotated = self._apply_annotations(data, annotations) if annotations else data
-                            except Exception as e:
-                                print(f"Alerta: falha ao aplicar anotações, usando imagem original: {str(e)}")
-                                annotated = data
-
-                            rec = self.quick_reencode_jpg(annotated)
-                            if rec is None:
-                                try:
-                                    Image.open(io.BytesIO(annotated)).close()
-                                    final_bytes = annotated
-                                except Exception:
-                                    print("Alerta: bytes de imagem inválidos após fallback; imagem será ignorada")
-                                    continue
-                            else:
-                                final_bytes = rec
-
-                            descriptions: List[str] = []
-                            for ann in annotations:
-                                desc = (ann.get('description') or '').strip()
-                                if desc:
-                                    descriptions.append(f"- {desc}")
-                            caption = "\n".join(descriptions)
-                            processed_images_with_captions.append((final_bytes, caption))
-
-                        for img_data, caption in processed_images_with_captions:
-                            if not img_data:
-                                continue
-                            if col_count == 3:
-                                pdf.ln(row_max_height + self.img_margin if row_max_height else (self.img_height + self.img_margin))
-                                pdf.set_x(x_start)
-                                col_count = 0
-                                row_max_height = 0
 
-                            x = pdf.get_x()
-                            y = pdf.get_y()
-                            try:
-                                with io.BytesIO(img_data) as img_buffer:
-                                    pdf.image(img_buffer, x=x, y=y, w=self.img_width, h=self.img_height)
-                            except Exception as e:
-                                print(f"Alerta: falha ao inserir imagem no PDF; ignorando. Erro: {str(e)}")
-                                continue
-
-                            used_height = self.img_height
-                            cap = (caption or '').strip()
-                            if cap:
-                                pdf.set_xy(x, y + self.img_height + 1)
-                                lines = self._get_text_line_count(pdf, cap.replace('\r', ''), self.img_width)
-                                line_h = 4
-                                pdf.set_font("helvetica", size=8)
-                                pdf.multi_cell(self.img_width, line_h, cap, border=0)
-                                pdf.set_font("helvetica", size=10)
-                                used_height += 1 + lines * line_h
-
-                            row_max_height = max(row_max_height, used_height)
-                            pdf.set_xy(x + self.img_width + self.img_margin, y)
-                            col_count += 1
-
-                        if col_count > 0:
-                            pdf.ln(row_max_height + 4 if row_max_height else (self.img_height + 4))
-                        else:
-                            pdf.ln(5)
+                    if col_count > 0:
+                        pdf.ln(row_max_height + 4 if row_max_height else (self.img_height + 4))
                     else:
                         pdf.ln(5)
+                else:
+                    pdf.ln(5)
 
-                    pdf.ln(4)
+                pdf.ln(4)
 
-            pdf_bytes = pdf.output()
-            if isinstance(pdf_bytes, bytearray):
-                pdf_bytes = bytes(pdf_bytes)
-            return pdf_bytes
+            return pdf
 
         except Exception as e:
             print(f"ERRO CRÍTICO ao gerar PDF PGR para a chave {key}: {str(e)}")
             print(traceback.format_exc())
             raise
 
+    def generate_pdf(self, request_data: Dict, key: str) -> bytearray:
+        # Devolve o bytearray do fpdf sem copiar para bytes: Response/escrita aceitam qualquer buffer
+        return self._build_pdf(request_data, key).output()
+
+    def generate_pdf_stream(self, request_data: Dict, key: str) -> tempfile.SpooledTemporaryFile:
+        """Gera o PDF num arquivo temporário (em memória até 2MB, depois em disco) posicionado no início."""
+        pdf = self._build_pdf(request_data, key)
+        out = tempfile.SpooledTemporaryFile(max_size=2_000_000)
+        try:
+            pdf.output(out)
+        except Exception:
+            out.close()
+            raise
+        del pdf
+        out.seek(0)
+        return out
+
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 
 app = Flask(__name__)
-generator = PgrChecklistPDFGenerator()
+# Criado no 1º request, não no import: com 'python main.py', os processos 'spawn' do CPU_POOL
+# reimportam este arquivo e não devem abrir cliente GCS nem sessão HTTP
+_generator: Optional[PgrChecklistPDFGenerator] = None
+_generator_lock = threading.Lock()
+
+
+def get_generator() -> PgrChecklistPDFGenerator:
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = PgrChecklistPDFGenerator()
+        return _generator
+
 
 @app.route('/generate-report', methods=['POST'])
 def generate_report_endpoint():
@@ -644,17 +890,27 @@ def generate_report_endpoint():
         if not key:
             return Response("Parâmetro 'key' obrigatório", status=400)
 
-        request_data = request.get_json()
+        # Mesma exigência do request.get_json(): corpo declarado como application/json
+        if not request.is_json:
+            return Response("Content-Type deve ser application/json", status=400)
+        raw = request.get_data(cache=False)
+        try:
+            request_data = orjson.loads(raw) if raw else None
+        except orjson.JSONDecodeError:
+            return Response("JSON do corpo inválido", status=400)
         if not request_data:
             return Response("JSON do corpo obrigatório", status=400)
 
-        pdf_bytes = generator.generate_pdf(request_data, key)
+        pdf_file = get_generator().generate_pdf_stream(request_data, key)
 
-        return Response(
-            pdf_bytes,
+        # Corpo enviado em blocos de 64KB (chunked) direto do arquivo temporário
+        response = Response(
+            stream_with_context(iter(partial(pdf_file.read, 65536), b'')),
             mimetype='application/pdf',
             headers={"Content-Disposition": f'attachment; filename="checklist-pgr-{key}.pdf"'}
         )
+        response.call_on_close(pdf_file.close)
+        return response
     except ValueError as ve:
         return Response(str(ve), status=400)
     except Exception as e: